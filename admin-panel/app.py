@@ -1,19 +1,155 @@
 import os
-import requests
-from flask import Flask, render_template, jsonify, request, redirect, url_for
+import orjson
+import time
+import httpx
+import redis.asyncio as redis
+from functools import wraps
+from werkzeug.exceptions import RequestEntityTooLarge
+from quart import Quart, render_template, jsonify, request, redirect, url_for
+from quart.json.provider import JSONProvider
 
 # --- Configuração Inicial ---
-app = Flask(__name__)
+app = Quart(__name__)
+
+class ORJSONProvider(JSONProvider):
+    """jsonify e request.get_json com orjson: serializa direto para bytes, sem passar pelo json da stdlib."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+app.json = ORJSONProvider(app)
 
 # Pega as URLs das APIs a partir das variáveis de ambiente
 URL_API_POLITICAS = os.environ.get('URL_API_POLITICAS')
 URL_API_CONSENTIMENTOS = os.environ.get('URL_API_CONSENTIMENTOS')
 ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', 'super-secret-admin-token-123')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
+
+# O Quart limita o corpo a 16 MiB e 60 s por padrão (o Flask não limitava): documentos de
+# política maiores ou enviados devagar seriam recusados antes de chegar à api-politicas
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', '100'))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+app.config['BODY_TIMEOUT'] = int(os.environ.get('UPLOAD_BODY_TIMEOUT', '600')) # segundos
+
+# Cliente HTTP assíncrono compartilhado: enquanto uma chamada às APIs internas
+# aguarda resposta, o mesmo worker atende outras requisições
+client = None
+cache = None # Cliente Redis, compartilhado da mesma forma
+
+# Falhas ao abrir a conexão (origem reiniciando, DNS do Docker) são repetidas com
+# backoff exponencial; como a requisição não chegou à origem, vale também para POST/DELETE
+UPSTREAM_RETRIES = 2
+
+def upstream_transport(max_connections, max_keepalive_connections=None):
+    """
+    Transporte com pool próprio para um host interno. HTTP/2 multiplexa as chamadas
+    em uma única conexão TCP; se a origem não negociar h2 (ex.: http:// sem proxy na frente), usa HTTP/1.1.
+    """
+    return httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=UPSTREAM_RETRIES,
+        limits=httpx.Limits(
+            max_keepalive_connections=max_keepalive_connections or max_connections,
+            max_connections=max_connections
+        )
+    )
+
+@app.before_serving
+async def open_client():
+    global client, cache
+    cache = redis.Redis.from_url(REDIS_URL)
+    client = httpx.AsyncClient(
+        # (connect, read): 1 s para abrir a conexão, 5 s para as demais operações
+        timeout=httpx.Timeout(5.0, connect=1.0),
+        transport=upstream_transport(200, max_keepalive_connections=100),
+        # Um pool por API interna: um host lento não esgota as conexões dos outros
+        mounts={
+            url: upstream_transport(50)
+            for url in (URL_API_POLITICAS, URL_API_CONSENTIMENTOS) if url
+        },
+    )
+
+@app.after_serving
+async def close_client():
+    await client.aclose()
+    await cache.aclose()
+
+# --- Cache da Política Vigente (Redis) ---
+LATEST_POLICY_KEY = 'policies:latest'
+CHATBOT_POLICY_KEY = 'policies:latest:validated' # cópia validada mantida pelo smart-chatbot
+LATEST_POLICY_TTL = 30          # segundos em que a entrada é servida sem consultar a api-politicas
+STALE_KEEP_SECONDS = 24 * 3600  # por quanto tempo a última resposta fica guardada como fallback
+ADMIN_HTML_KEY_PREFIX = 'admin:html:' # + hash da política vigente (ou 'none')
+ADMIN_HTML_TTL = 300
+
+def cached(key, ttl):
+    """
+    Guarda a resposta (status, corpo) da função decorada em um hash do Redis e devolve
+    (status, corpo, estado_do_cache). Entrada fresca é servida direto; com a entrada velha,
+    só quem obtém o lock (SET NX PX) consulta a origem e os demais servem a cópia antiga.
+    Se a origem estiver fora do ar, serve a última cópia conhecida ('stale').
+    """
+    def decorator(fetch):
+        @wraps(fetch)
+        async def wrapper():
+            now = time.time()
+            try:
+                entry = await cache.hgetall(key)
+            except redis.RedisError:
+                entry = None
+
+            if entry:
+                stale = (int(entry[b'status']), entry[b'body'], 'stale')
+                if float(entry[b'stale_at']) > now:
+                    return int(entry[b'status']), entry[b'body'], 'hit'
+                try:
+                    if not await cache.set(f"{key}:lock", 1, nx=True, px=ttl * 1000):
+                        return stale # Outro worker já está atualizando a entrada
+                except redis.RedisError:
+                    pass
+
+            try:
+                status, body = await fetch()
+            except httpx.RequestError:
+                if entry:
+                    return stale
+                raise
+            if status >= 500:
+                return stale if entry else (status, body, 'miss')
+
+            try:
+                async with cache.pipeline(transaction=True) as pipe:
+                    pipe.hset(key, mapping={'status': status, 'body': body, 'stale_at': now + ttl})
+                    pipe.expire(key, STALE_KEEP_SECONDS)
+                    await pipe.execute()
+            except redis.RedisError:
+                pass
+            return status, body, 'miss'
+        return wrapper
+    return decorator
+
+@cached(LATEST_POLICY_KEY, LATEST_POLICY_TTL)
+async def fetch_latest_policy():
+    response = await client.get(f"{URL_API_POLITICAS}/policies/latest")
+    return response.status_code, response.content
+
+def upstream_error(response):
+    """Mensagem de erro devolvida por uma API interna (campo 'error' do JSON, se houver)."""
+    try:
+        return orjson.loads(response.content).get('error', f"HTTP {response.status_code}")
+    except (orjson.JSONDecodeError, AttributeError):
+        return f"HTTP {response.status_code}: {response.text}"
 
 # --- Rotas do Admin Panel ---
 
 @app.route('/')
-def index():
+async def index():
     """Redireciona a raiz para a página de gestão de políticas"""
     return redirect(url_for('admin_page'))
 
@@ -21,79 +157,110 @@ def index():
 # --- ROTAS DE ADMIN PARA UPLOAD DA POLÍTICA ---
 
 @app.route('/admin')
-def admin_page():
+async def admin_page():
     """
     Serve a página HTML com o formulário de upload E A ÚLTIMA POLÍTICA.
     """
     latest_policy_info = None # Variável para guardar a info
     try:
-        # Chama a API de Políticas (comunicação interna do Docker)
-        response = requests.get(f"{URL_API_POLITICAS}/policies/latest")
+        # Chama a API de Políticas (comunicação interna do Docker), passando pelo cache
+        status, body, _ = await fetch_latest_policy()
 
-        if response.status_code == 200:
-            latest_policy_info = response.json() # Guarda o JSON da política
-        elif response.status_code == 404:
+        if status == 200:
+            latest_policy_info = orjson.loads(body) # Guarda o JSON da política
+        elif status == 404:
             # Nenhuma política cadastrada, o que é ok
-            pass 
+            pass
         else:
             # Outro erro, mas não vamos quebrar a página de admin por isso
-            print(f"Erro ao buscar latest policy: {response.text}") # Loga o erro no console do Docker
+            print(f"Erro ao buscar latest policy: {body.decode(errors='replace')}") # Loga o erro no console do Docker
 
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         print(f"Erro de conexão ao buscar latest policy: {str(e)}") # Loga o erro
 
+    # A página só depende da política vigente: o HTML já renderizado fica no Redis,
+    # indexado pelo hash dela, e o Jinja só roda quando a política muda
+    html_key = ADMIN_HTML_KEY_PREFIX + (latest_policy_info['hash'] if latest_policy_info else 'none')
+    try:
+        html = await cache.get(html_key)
+        if html:
+            return html
+    except redis.RedisError:
+        pass
+
     # Renderiza o template, passando a informação da política (pode ser None)
-    return render_template('admin.html', latest_policy=latest_policy_info)
+    html = await render_template('admin.html', latest_policy=latest_policy_info)
+    try:
+        await cache.set(html_key, html, ex=ADMIN_HTML_TTL)
+    except redis.RedisError:
+        pass
+    return html
 
 @app.route('/upload-policy', methods=['POST'])
-def upload_policy_proxy():
+async def upload_policy_proxy():
     """
     Recebe o formulário da página /admin e o REPASSA para a api-politicas.
     Isto é um "proxy" para a API de políticas.
     """
     try:
         # 1. Obter os dados do formulário recebido
+        form = await request.form
         form_data = {
-            'version': request.form.get('version'),
-            'description': request.form.get('description')
+            'version': form.get('version'),
+            'description': form.get('description')
         }
+        # Campos ausentes não entram no multipart
+        form_data = {k: v for k, v in form_data.items() if v is not None}
 
-        files = request.files.get('file')
+        files = (await request.files).get('file')
 
         if not files:
             return "Erro: Nenhum arquivo enviado", 400
 
-        # 2. Reempacotar os arquivos para a biblioteca requests
+        # 2. Reempacotar os arquivos para o httpx
         # (filename, file-object, content-type)
+        # O stream é repassado sem .read(): o httpx monta o multipart lendo o arquivo
+        # em blocos de 64 KiB, e o Quart guarda uploads grandes (até MAX_UPLOAD_MB) em arquivo temporário
         proxied_files = {
             'file': (files.filename, files.stream, files.mimetype)
         }
 
         # 3. Chamar a api-politicas (interna do Docker)
         headers = {'Authorization': f'Bearer {ADMIN_TOKEN}'}
-        response = requests.post(
+        response = await client.post(
             f"{URL_API_POLITICAS}/policies",
             files=proxied_files,
             data=form_data,
-            headers=headers
+            headers=headers,
+            # A api-politicas só responde depois de enviar o arquivo inteiro ao MinIO
+            timeout=httpx.Timeout(60.0, connect=1.0)
         )
 
-        # Lança um erro se a api-politicas falhar
-        response.raise_for_status() 
+        # Se a api-politicas recusar (ex: hash duplicado), mostra o erro
+        if response.status_code >= 400:
+            return f"Erro ao enviar para API de Políticas: {upstream_error(response)}", response.status_code
+
+        # A política vigente mudou: invalida o cache (JSON e HTML da página de admin)
+        # SCAN em lotes de 500 (não bloqueia o Redis como KEYS) e UNLINK (memória liberada
+        # em segundo plano pelo Redis); todas as chaves saem em um único UNLINK
+        try:
+            html_keys = [key async for key in cache.scan_iter(match=f"{ADMIN_HTML_KEY_PREFIX}*", count=500)]
+            await cache.unlink(LATEST_POLICY_KEY, CHATBOT_POLICY_KEY, *html_keys)
+        except redis.RedisError as e:
+            print(f"Erro ao invalidar o cache da latest policy: {str(e)}")
 
         # 4. Se deu certo, redireciona de volta para a pág. de admin
         return redirect(url_for('admin_page'))
 
-    except requests.exceptions.RequestException as e:
-        # Se a api-politicas der erro (ex: hash duplicado), mostra o erro
-        if e.response:
-            return f"Erro ao enviar para API de Políticas: {e.response.json().get('error', str(e))}", e.response.status_code
+    except RequestEntityTooLarge:
+        return f"Erro: o arquivo excede o limite de {MAX_UPLOAD_MB} MB", 413
+    except httpx.RequestError as e:
         return f"Erro de conexão com a API de Políticas: {str(e)}", 503
     except Exception as e:
         return f"Erro interno no proxy: {str(e)}", 500
 
 @app.route('/audit')
-def audit_page():
+async def audit_page():
     """
     Serve a página de auditoria, buscando os logs de um usuário.
     Espera um parâmetro na URL: /audit?user_id=...
@@ -105,26 +272,23 @@ def audit_page():
     try:
         # Chama a API de Consentimentos na rota administrativa (comunicação interna do Docker)
         headers = {'Authorization': f'Bearer {ADMIN_TOKEN}'}
-        response = requests.get(
+        response = await client.get(
             f"{URL_API_CONSENTIMENTOS}/admin/consents/user/{user_id}",
             headers=headers
         )
 
         if response.status_code == 200:
-            consent_list = response.json() # Lista de logs
+            consent_list = orjson.loads(response.content) # Lista de logs
         elif response.status_code == 404:
             # Usuário não tem logs, o que é ok. A lista fica vazia.
-            pass 
+            pass
         else:
             # Outros erros (500, etc)
-            response.raise_for_status() 
-    except requests.exceptions.RequestException as e:
-        error_message = f"Erro ao contatar API de Consentimentos: {str(e)}"
-        if e.response:
-            error_message = e.response.json().get('error', str(e))
-        return error_message, 503
+            return upstream_error(response), 503
+    except httpx.RequestError as e:
+        return f"Erro ao contatar API de Consentimentos: {str(e)}", 503
     # Renderiza o novo template 'audit.html', passando as variáveis
-    return render_template('audit.html', user_id=user_id, consents=consent_list)
+    return await render_template('audit.html', user_id=user_id, consents=consent_list)
 
 #  --- Ponto de Partida ---
 if __name__ == '__main__':
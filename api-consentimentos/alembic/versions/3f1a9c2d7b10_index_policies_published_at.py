@@ -0,0 +1,30 @@
+"""index policies.published_at
+
+Revision ID: 3f1a9c2d7b10
+Revises: 
+Create Date: 2026-10-14 12:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1a9c2d7b10'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # O B-tree é percorrido de trás para frente no ORDER BY published_at DESC,
+    # então o mesmo índice criado pelo db.create_all() atende /policies/latest.
+    op.create_index('ix_policies_published_at', 'policies', ['published_at'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_policies_published_at', table_name='policies', if_exists=True)
@@ -0,0 +1,36 @@
+"""covering index for consents history
+
+Revision ID: 8c4e2b6f1d93
+Revises: 3f1a9c2d7b10
+Create Date: 2026-10-14 14:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4e2b6f1d93'
+down_revision: Union[str, Sequence[str], None] = '3f1a9c2d7b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_consents_pseudo_createdat', 'consents',
+        ['subject_pseudonym', sa.text('created_at DESC')],
+        postgresql_include=['id', 'id_policy', 'channel', 'validation_hash', 'status'],
+        if_not_exists=True,
+    )
+    # O novo índice tem subject_pseudonym como prefixo, então o índice simples fica redundante
+    op.drop_index('ix_consents_subject_pseudonym', table_name='consents', if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_consents_subject_pseudonym', 'consents', ['subject_pseudonym'], if_not_exists=True)
+    op.drop_index('ix_consents_pseudo_createdat', table_name='consents', if_exists=True)
@@ -3,11 +3,14 @@ import jwt
 import hmac
 import hashlib
 import secrets
-from functools import wraps
+import time
+import orjson
+from functools import wraps, lru_cache
 from datetime import datetime
+from typing import Literal
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import joinedload
+from pydantic import BaseModel, Field, ValidationError
 
 # --- Configuração Inicial ---
 app = Flask(__name__)
@@ -17,33 +20,63 @@ db_url = os.environ.get('DATABASE_URL', 'sqlite:///local_poc.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Sem eco de SQL nem registro de queries: nenhum custo de log por statement
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'echo': False}
+
+# Pool de conexões dimensionado para a concorrência dos workers (apenas PostgreSQL):
+# cada worker do Gunicorn tem 16 threads, e o orçamento total cabe no max_connections padrão (100)
+if db_url.startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': 16,
+        'max_overflow': 4,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'connect_args': {'options': '-c statement_timeout=5000'}
+    })
+
 # Chave secreta para assinar e validar os tokens JWT (Deve ir para o .env na AWS)
 app.config['JWT_SECRET'] = os.environ.get('JWT_SECRET', 'chave-super-secreta-para-a-poc')
 admin_token = os.environ.get('ADMIN_TOKEN', 'super-secret-admin-token-123')
 
-db = SQLAlchemy(app)
+# expire_on_commit=False mantém os atributos carregados após o commit, sem novo SELECT
+db = SQLAlchemy(app, session_options={'expire_on_commit': False})
+
+# Serializa com orjson (datetimes nativos, sem passar pelo json da stdlib)
+def _jsonbytes(obj):
+    return app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+# Referência direta ao construtor evita a busca de atributo em hashlib a cada requisição
+_sha256 = hashlib.sha256
 
 # --- Decorator de Segurança (O Pulo do Gato Acadêmico) ---
+# O mesmo token chega várias vezes seguidas; a assinatura só é verificada no primeiro uso.
+# Tokens inválidos ou expirados levantam exceção e, por isso, nunca entram no cache.
+@lru_cache(maxsize=1024)
+def _decode_token(token: str) -> dict:
+    return jwt.decode(token, app.config['JWT_SECRET'], algorithms=["HS256"])
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        # Verifica se o cabeçalho Authorization está presente
-        if 'Authorization' in request.headers:
-            parts = request.headers['Authorization'].split()
-            if len(parts) == 2 and parts[0] == 'Bearer':
-                token = parts[1]
+        # Verifica se o cabeçalho Authorization está presente no formato 'Bearer <token>'
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
         
-        if not token:
+        if scheme != 'Bearer' or not token:
             return jsonify({'error': 'Acesso negado: Token de autenticação ausente.'}), 401
         
         try:
             # Decodifica o token para extrair a identidade real do usuário
-            data = jwt.decode(token, app.config['JWT_SECRET'], algorithms=["HS256"])
-            current_user_id = data['user_id']
+            data = _decode_token(token)
+            # Um payload em cache pode ter expirado depois de decodificado
+            if 'exp' in data and data['exp'] <= time.time():
+                raise jwt.ExpiredSignatureError
+            # Converte a identidade para int uma única vez; os handlers comparam direto
+            current_user_id = int(data['user_id'])
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Acesso negado: Token expirado.'}), 401
-        except jwt.InvalidTokenError:
+        except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
             return jsonify({'error': 'Acesso negado: Token inválido.'}), 401
             
         # Injeta o ID extraído do token na função protegida
@@ -53,23 +86,39 @@ def token_required(f):
 def admin_token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            parts = request.headers['Authorization'].split()
-            if len(parts) == 2 and parts[0] == 'Bearer':
-                token = parts[1]
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
         
-        if not token or token != admin_token:
+        if scheme != 'Bearer' or not token or token != admin_token:
             return jsonify({'error': 'Acesso negado: Token administrativo inválido ou ausente.'}), 401
             
         return f(*args, **kwargs)
     return decorated
 
 # --- Função de Crypto-Shredding ---
+# Sem memoização de propósito: um cache guardaria a secret_key (ou o pseudônimo derivado dela)
+# na memória de cada worker do Gunicorn, e o esquecimento só limparia o worker que o atendeu
 def generate_pseudonym(user_id: int, secret_key: str) -> str:
-    key_bytes = secret_key.encode('utf-8')
-    msg_bytes = str(user_id).encode('utf-8')
-    return hmac.new(key_bytes, msg_bytes, hashlib.sha256).hexdigest()
+    # b'%d' % user_id gera os mesmos bytes de str(user_id).encode() sem a string intermediária
+    return hmac.new(secret_key.encode(), b'%d' % user_id, hashlib.sha256).hexdigest()
+
+# --- Esquema de Entrada (validado pelo pydantic-core direto dos bytes da requisição) ---
+class ConsentIn(BaseModel):
+    id_user: int
+    id_policy: int
+    channel: str = Field(max_length=50)
+    status: Literal['given', 'refused']
+
+# --- Hash de Validação (Auditoria) ---
+def build_validation_hash(subject_pseudonym: str, id_policy: int, timestamp: datetime, channel: str, status: str) -> str:
+    hash_input = b":".join((subject_pseudonym.encode(), str(id_policy).encode(), timestamp.isoformat().encode(), channel.encode(), status.encode()))
+    return _sha256(hash_input).hexdigest()
+
+def verify_validation_hashes(rows) -> list:
+    """Recalcula o hash de cada registro e compara com o valor armazenado."""
+    return [
+        build_validation_hash(r.subject_pseudonym, r.id_policy, r.created_at, r.channel, r.status) == r.validation_hash
+        for r in rows
+    ]
 
 # --- Modelos de Dados (Mantidos intactos) ---
 class UserCrypto(db.Model):
@@ -81,36 +130,68 @@ class Policies(db.Model):
     __tablename__ = 'policies'
     id = db.Column(db.Integer, primary_key=True)
     version = db.Column(db.String(20), nullable=False)
-    published_at = db.Column(db.TIMESTAMP, server_default=db.func.now())
+    published_at = db.Column(db.TIMESTAMP, server_default=db.func.now(), index=True)
     description = db.Column(db.Text, nullable=True)
     url = db.Column(db.Text, nullable=False)
     hash = db.Column(db.String(64), nullable=False, unique=True)
     consents = db.relationship('Consents', back_populates='policy')
 
     def to_json_brief(self):
-        return {'id': self.id, 'version': self.version, 'published_at': self.published_at.isoformat() if self.published_at else None}
+        return {'id': self.id, 'version': self.version, 'published_at': self.published_at}
 
 class Consents(db.Model):
     __tablename__ = 'consents'
     id = db.Column(db.Integer, primary_key=True, index=True) 
-    subject_pseudonym = db.Column(db.String(64), index=True, nullable=False)
+    subject_pseudonym = db.Column(db.String(64), nullable=False)
     id_policy = db.Column(db.Integer, db.ForeignKey('policies.id'), nullable=False) 
     created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow) 
     channel = db.Column(db.String(50), nullable=False) 
     validation_hash = db.Column(db.String(64), nullable=False, unique=True) 
     status = db.Column(db.String(20), nullable=False, default='given')
-    policy = db.relationship('Policies', back_populates='consents')
+    # Todo consentimento tem exatamente uma política: carrega sempre via JOIN, sem N+1
+    policy = db.relationship('Policies', back_populates='consents', lazy='joined', innerjoin=True)
 
     def to_json(self):
         return {
             'id': self.id, 'subject_pseudonym': self.subject_pseudonym, 'id_policy': self.id_policy,
-            'created_at': self.created_at.isoformat() if self.created_at else None, 'channel': self.channel,
+            'created_at': self.created_at, 'channel': self.channel,
             'validation_hash': self.validation_hash, 'status': self.status,
             'policy_info': self.policy.to_json_brief() if self.policy else None
         }
 
+# Índice de cobertura do histórico: filtra por pseudônimo já na ordem de created_at DESC (index-only scan).
+# Substitui o índice simples em subject_pseudonym, que é prefixo deste.
+db.Index('ix_consents_pseudo_createdat', Consents.subject_pseudonym, Consents.created_at.desc(),
+         postgresql_include=['id', 'id_policy', 'channel', 'validation_hash', 'status'])
+
+def consent_history(subject_pseudonym: str) -> list:
+    """Lê o histórico como tuplas de colunas, sem materializar objetos ORM, no mesmo formato de to_json()."""
+    rows = db.session.execute(
+        db.select(Consents.id, Consents.subject_pseudonym, Consents.id_policy, Consents.created_at, Consents.channel,
+                  Consents.validation_hash, Consents.status, Policies.version, Policies.published_at)
+        .join(Consents.policy)
+        .where(Consents.subject_pseudonym == subject_pseudonym)
+        .order_by(Consents.created_at.desc())
+    ).all()
+    return [{
+        'id': r.id, 'subject_pseudonym': r.subject_pseudonym, 'id_policy': r.id_policy,
+        'created_at': r.created_at, 'channel': r.channel,
+        'validation_hash': r.validation_hash, 'status': r.status,
+        'policy_info': {'id': r.id_policy, 'version': r.version, 'published_at': r.published_at}
+    } for r in rows]
+
+# O DO UPDATE sem efeito garante que o RETURNING devolva a chave também quando o titular já existe
+_UPSERT_USER_CRYPTO = db.text(
+    "INSERT INTO users_crypto (id_user, secret_key) VALUES (:u, :k) "
+    "ON CONFLICT (id_user) DO UPDATE SET id_user = users_crypto.id_user "
+    "RETURNING secret_key"
+)
+
 with app.app_context():
     db.create_all()
+    # Com --preload o módulo é importado antes do fork: descarta as conexões
+    # abertas aqui para que cada worker crie as suas próprias
+    db.engine.dispose()
 
 # --- Endpoints Protegidos ---
 
@@ -118,46 +199,45 @@ with app.app_context():
 @token_required
 def create_consent(current_user_id):
     """Registra o consentimento validando a identidade do token."""
-    data = request.get_json()
-    
-    if not data or 'id_user' not in data or 'id_policy' not in data or 'channel' not in data or 'status' not in data:
+    try:
+        data = ConsentIn.model_validate_json(request.get_data())
+    except ValidationError:
         return jsonify({"error": "Dados incompletos"}), 400
 
     # A REGRA DE OURO DA AUTORIZAÇÃO: O ID do corpo do JSON deve casar com o ID do Token assinado.
-    if int(data['id_user']) != int(current_user_id):
+    if data.id_user != current_user_id:
         return jsonify({"error": "Conflito de Identidade: O titular do token não tem permissão para assinar por outro usuário."}), 403
 
     try:
-        id_user = int(current_user_id) # Usamos a identidade validada criptograficamente
-        id_policy = data['id_policy']
-        channel = data['channel']
-        status = data['status']
+        id_user = current_user_id # Usamos a identidade validada criptograficamente
+        id_policy = data.id_policy
+        channel = data.channel
+        status = data.status
         
-        user = db.session.get(UserCrypto, id_user)
-        if not user:
-            user = UserCrypto(id_user=id_user)
-            db.session.add(user)
-            db.session.commit()
+        # Busca ou cria a chave do titular em um único round-trip; o commit acontece junto com o consentimento
+        user = db.session.execute(_UPSERT_USER_CRYPTO, {"u": id_user, "k": secrets.token_hex(32)}).one()
             
         if not user.secret_key:
+            db.session.rollback()
             return jsonify({"error": "Titular anonimizado. Não é possível registrar novos dados."}), 403
 
-        subject_pseudonym = generate_pseudonym(user.id_user, user.secret_key)
+        subject_pseudonym = generate_pseudonym(id_user, user.secret_key)
         
         policy_exists = db.session.get(Policies, id_policy)
         if not policy_exists:
+            # Descarta o upsert pendente em users_crypto: nada deste pedido é gravado
+            db.session.rollback()
             return jsonify({"error": f"Política não encontrada"}), 404
 
         timestamp = datetime.utcnow()
-        hash_input = f"{subject_pseudonym}:{id_policy}:{timestamp.isoformat()}:{channel}:{status}"
-        validation_hash = hashlib.sha256(hash_input.encode('utf-8')).hexdigest()
+        validation_hash = build_validation_hash(subject_pseudonym, id_policy, timestamp, channel, status)
 
-        new_consent = Consents(subject_pseudonym=subject_pseudonym, id_policy=id_policy, channel=channel, validation_hash=validation_hash, created_at=timestamp, status=status)
+        # Reaproveita a política já carregada na sessão em vez de um refresh após o commit
+        new_consent = Consents(subject_pseudonym=subject_pseudonym, id_policy=id_policy, channel=channel, validation_hash=validation_hash, created_at=timestamp, status=status, policy=policy_exists)
         db.session.add(new_consent)
         db.session.commit()
-        db.session.refresh(new_consent)
 
-        return jsonify({"message": "Consentimento registrado com sucesso!", "consent": new_consent.to_json()}), 201
+        return _jsonbytes({"message": "Consentimento registrado com sucesso!", "consent": new_consent.to_json()}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": f"Erro interno: {str(e)}"}), 500
@@ -166,7 +246,7 @@ def create_consent(current_user_id):
 @token_required
 def get_consents_by_user(current_user_id, user_id):
     """Consulta o histórico garantindo que o usuário só veja os seus próprios dados."""
-    if int(current_user_id) != int(user_id):
+    if current_user_id != user_id:
         return jsonify({"error": "Acesso não autorizado ao histórico de terceiros."}), 403
 
     try:
@@ -175,20 +255,37 @@ def get_consents_by_user(current_user_id, user_id):
             return jsonify({"error": "Usuário não encontrado ou já foi anonimizado."}), 404
 
         subject_pseudonym = generate_pseudonym(user.id_user, user.secret_key)
-        consents = Consents.query.options(joinedload(Consents.policy)).filter_by(subject_pseudonym=subject_pseudonym).order_by(Consents.created_at.desc()).all()
+        consents = consent_history(subject_pseudonym)
         
         if not consents:
             return jsonify({"error": "Nenhum consentimento encontrado"}), 404
             
-        return jsonify([c.to_json() for c in consents]), 200
+        return _jsonbytes(consents), 200
     except Exception as e:
         return jsonify({"error": f"Erro interno: {str(e)}"}), 500
 
 @app.route('/consents/policy/<int:policy_id>', methods=['GET'])
 def get_consents_by_policy(policy_id):
     """(Este endpoint pode ficar aberto para auditoria, pois os usuários estão pseudonimizados)"""
-    # ... (código original mantido) ...
-    pass # Coloque aqui o seu código original de get_consents_by_policy
+    try:
+        rows = db.session.execute(
+            db.select(Consents.id, Consents.subject_pseudonym, Consents.id_policy, Consents.created_at,
+                      Consents.channel, Consents.validation_hash, Consents.status)
+            .where(Consents.id_policy == policy_id)
+            .order_by(Consents.created_at.desc())
+        ).all()
+
+        if not rows:
+            return jsonify({"error": "Nenhum consentimento encontrado"}), 404
+
+        # Cada registro sai com o resultado da verificação de integridade do seu hash
+        return _jsonbytes([{
+            'id': r.id, 'subject_pseudonym': r.subject_pseudonym, 'id_policy': r.id_policy,
+            'created_at': r.created_at, 'channel': r.channel,
+            'validation_hash': r.validation_hash, 'status': r.status, 'hash_valid': valid
+        } for r, valid in zip(rows, verify_validation_hashes(rows))]), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno: {str(e)}"}), 500
 
 @app.route('/admin/consents/user/<int:user_id>', methods=['GET'])
 @admin_token_required
@@ -200,12 +297,12 @@ def admin_get_consents_by_user(user_id):
             return jsonify({"error": "Usuário não encontrado ou já foi anonimizado."}), 404
 
         subject_pseudonym = generate_pseudonym(user.id_user, user.secret_key)
-        consents = Consents.query.options(joinedload(Consents.policy)).filter_by(subject_pseudonym=subject_pseudonym).order_by(Consents.created_at.desc()).all()
+        consents = consent_history(subject_pseudonym)
         
         if not consents:
             return jsonify({"error": "Nenhum consentimento encontrado"}), 404
             
-        return jsonify([c.to_json() for c in consents]), 200
+        return _jsonbytes(consents), 200
     except Exception as e:
         return jsonify({"error": f"Erro interno: {str(e)}"}), 500
 
@@ -213,7 +310,7 @@ def admin_get_consents_by_user(user_id):
 @token_required
 def forget_user(current_user_id, user_id):
     """Executa o esquecimento garantindo que apenas o próprio usuário pode apagar os seus dados."""
-    if int(current_user_id) != int(user_id):
+    if current_user_id != user_id:
         return jsonify({"error": "Acesso não autorizado para acionar o esquecimento."}), 403
 
     try:
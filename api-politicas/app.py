@@ -3,10 +3,13 @@ import hashlib
 import boto3
 import json
 from functools import wraps
+from uuid import uuid4
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import raiseload
 from botocore.client import Config
-from botocore.exceptions import NoCredentialsError
+from botocore.exceptions import ClientError, NoCredentialsError
+from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
 
 
@@ -24,6 +27,23 @@ admin_token = os.environ.get('ADMIN_TOKEN', 'super-secret-admin-token-123')
 
 # Configura o SQLAlchemy (Banco de Dados)
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Sem eco de SQL nem registro de queries: nenhum custo de log por statement
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'echo': False}
+
+# Pool de conexões dimensionado para a concorrência dos workers (apenas PostgreSQL):
+# cada worker do Gunicorn tem 16 threads, e o orçamento total cabe no max_connections padrão (100)
+if db_url and db_url.startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': 16,
+        'max_overflow': 4,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'connect_args': {'options': '-c statement_timeout=5000'}
+    })
+
 db = SQLAlchemy(app)
 
 # Configura o Boto3 (Cliente MinIO/S3)
@@ -33,8 +53,24 @@ s3_client = boto3.client(
     endpoint_url=minio_url_internal,
     aws_access_key_id=minio_access_key,
     aws_secret_access_key=minio_secret_key,
+    config=Config(
+        signature_version='s3v4',
+        # Sem isso uma chamada ao MinIO travado prende a thread do worker por até 60 s
+        connect_timeout=1, read_timeout=5,
+        # Modo 'standard': repete 5xx/throttling/erros de conexão com backoff exponencial e jitter
+        retries={'max_attempts': 3, 'mode': 'standard'}
+    )
+)
+
+# Cliente usado só para assinar URLs: a assinatura inclui o host, que precisa ser o endereço público
+s3_presign_client = boto3.client(
+    's3',
+    endpoint_url=minio_url_public or minio_url_internal,
+    aws_access_key_id=minio_access_key,
+    aws_secret_access_key=minio_secret_key,
     config=Config(signature_version='s3v4')
 )
+PRESIGN_EXPIRES_IN = 600 # segundos
 
 # --- Modelo de Dados (Tabela Policies) ---
 # Define a estrutura da tabela no PostgreSQL [cite: 3373, 3374]
@@ -42,7 +78,7 @@ class Policies(db.Model):
     __tablename__ = 'policies' # Nome da tabela como na sua dissertação
     id = db.Column(db.Integer, primary_key=True) # Usei Integer auto-incrementável (mais simples que UUID para PK)
     version = db.Column(db.String(20), nullable=False) # 'versao' [cite: 3374]
-    published_at = db.Column(db.TIMESTAMP, server_default=db.func.now()) # 'criado_em' [cite: 3374]
+    published_at = db.Column(db.TIMESTAMP, server_default=db.func.now(), index=True) # 'criado_em' [cite: 3374]
     description = db.Column(db.Text, nullable=True) # 'descricao' [cite: 3374]
     url = db.Column(db.Text, nullable=False) # 'url' [cite: 3374]
     hash = db.Column(db.String(64), nullable=False, unique=True) # 'hash' [cite: 3374]
@@ -57,28 +93,140 @@ class Policies(db.Model):
             'hash': self.hash
         }
 
+# --- Leitura com Hash ---
+class HashingReader:
+    """
+    Envolve o stream do arquivo e atualiza o SHA-256 a cada bloco lido pelo boto3,
+    evitando carregar o arquivo inteiro na memória e lê-lo duas vezes.
+    """
+    def __init__(self, src):
+        self.src = src
+        self.h = hashlib.sha256()
+
+    def read(self, n=-1):
+        b = self.src.read(n)
+        self.h.update(b)
+        return b
+
 # -- CRIA AS TABELAS  ---
 with app.app_context():
     db.create_all()
+    # Com --preload o módulo é importado antes do fork: descarta as conexões
+    # abertas aqui para que cada worker crie as suas próprias
+    db.engine.dispose()
 
 # --- Segurança: Validação de ADMIN_TOKEN ---
 def admin_token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            parts = request.headers['Authorization'].split()
-            if len(parts) == 2 and parts[0] == 'Bearer':
-                token = parts[1]
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
         
-        if not token or token != admin_token:
+        if scheme != 'Bearer' or not token or token != admin_token:
             return jsonify({'error': 'Acesso negado: Token administrativo inválido ou ausente.'}), 401
             
         return f(*args, **kwargs)
     return decorated
 
+# --- Funções Auxiliares do Storage ---
+def ensure_bucket():
+    """Verifica e cria o bucket (com leitura pública) se ele não existir."""
+    try:
+        s3_client.head_bucket(Bucket=minio_bucket)
+    except:
+        # Se der erro (bucket não existe), a API cria ele na hora
+        s3_client.create_bucket(Bucket=minio_bucket)
+        # Define a política pública de leitura            
+        policy = {
+            "Version": "2012-10-17",
+            "Statement": [{
+                "Sid": "PublicRead",
+                "Effect": "Allow",
+                "Principal": "*",
+                "Action": ["s3:GetObject"],
+                "Resource": [f"arn:aws:s3:::{minio_bucket}/*"]
+            }]
+        }
+
+        # Aplica a política ao bucket
+        s3_client.put_bucket_policy(Bucket=minio_bucket, Policy=json.dumps(policy))
+
+def policy_url(object_name):
+    """URL pública (gravada em Policies.url) do objeto no bucket."""
+    return f"{minio_url_public}/{minio_bucket}/{object_name}"
+
+def save_policy(version, description, object_name, hash):
+    """Grava os metadados da política; em caso de hash duplicado, descarta o objeto no bucket."""
+    url = policy_url(object_name)
+
+    # A restrição UNIQUE em 'hash' detecta duplicatas sem um SELECT prévio
+    new_policy = Policies(
+        version=version,
+        description=description,
+        url=url,
+        hash=hash
+    )
+    db.session.add(new_policy)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Essa versão de hash já existe: descarta o objeto recém-enviado, a menos que ele
+        # seja o próprio arquivo da política existente (ex.: retry do mesmo 's3_key')
+        db.session.rollback()
+        existing = Policies.query.filter_by(hash=hash).first()
+        if not existing or existing.url != url:
+            s3_client.delete_object(Bucket=minio_bucket, Key=object_name)
+        if not existing:
+            # Outra restrição falhou (não o hash): nada a devolver como política existente
+            return jsonify({"error": "Não foi possível gravar a política: conflito com um registro existente"}), 409
+        return jsonify({"error": "Uma política com este mesmo conteúdo (hash) já existe", "policy": existing.to_json()}), 409 # Conflict
+
+    return jsonify({"message": "Política criada com sucesso!", "policy": new_policy.to_json()}), 201
+
 # --- Endpoints da API ---
 
+@app.route('/policies/presign', methods=['POST'])
+@admin_token_required
+def presign_policy_upload():
+    """
+    Gera uma URL pré-assinada para o cliente enviar o arquivo direto ao MinIO,
+    sem que os bytes passem pelo worker da API.
+    Espera um JSON com o campo 'filename' (e, opcionalmente, 'content_type'). O PUT deve
+    enviar os cabeçalhos devolvidos em 'upload_headers', que fazem parte da assinatura.
+    Depois do upload, o cliente chama POST /policies com {'s3_key', 'version', 'description'}.
+    """
+    data = request.get_json(silent=True)
+    if not data or not data.get('filename'):
+        return jsonify({"error": "Campo 'filename' é obrigatório"}), 400
+
+    try:
+        ensure_bucket()
+        object_name = f"{uuid4().hex}-{secure_filename(data['filename'])}"
+        # Mesmos metadados do upload multipart: o documento abre no navegador em vez de baixar
+        upload_headers = {
+            'Content-Type': data.get('content_type') or 'application/pdf',
+            'Content-Disposition': 'inline'
+        }
+        upload_url = s3_presign_client.generate_presigned_url(
+            'put_object',
+            Params={
+                'Bucket': minio_bucket,
+                'Key': object_name,
+                'ContentType': upload_headers['Content-Type'],
+                'ContentDisposition': upload_headers['Content-Disposition']
+            },
+            ExpiresIn=PRESIGN_EXPIRES_IN
+        )
+        return jsonify({
+            "upload_url": upload_url,
+            "upload_headers": upload_headers,
+            "s3_key": object_name,
+            "expires_in": PRESIGN_EXPIRES_IN
+        }), 200
+    except NoCredentialsError:
+        return jsonify({"error": "Credenciais do S3 não configuradas"}), 500
+    except Exception as e:
+        return jsonify({"error": f"Erro interno: {str(e)}"}), 500
+
 @app.route('/policies', methods=['POST'])
 @admin_token_required
 def create_policy():
@@ -88,7 +236,12 @@ def create_policy():
     - 'file': O documento da política (PDF, etc.)
     - 'version': A versão semântica (ex: "1.0.0")
     - 'description': Um breve resumo das mudanças
+    Ou um JSON com 's3_key' (devolvido por /policies/presign), 'version' e 'description'
+    para um arquivo já enviado ao MinIO pela URL pré-assinada.
     """
+    if request.is_json:
+        return create_policy_from_s3_key()
+
     # 1. Validação de entrada
     if 'file' not in request.files:
         return jsonify({"error": "Nenhum arquivo enviado"}), 400
@@ -101,50 +254,19 @@ def create_policy():
         return jsonify({"error": "Campos 'file' e 'version' são obrigatórios"}), 400
 
     try:
-        file_content = file.read()
-
-        # 2. Calcular Hash (Integridade)
-        hash = hashlib.sha256(file_content).hexdigest()
-
-        # Verifica se essa versão de hash já existe
-        existing = Policies.query.filter_by(hash=hash).first()
-        if existing:
-            return jsonify({"error": "Uma política com este mesmo conteúdo (hash) já existe", "policy": existing.to_json()}), 409 # Conflict
-
-      # 3. Upload para o MinIO/S3
-        # Nome do objeto no bucket
+        # 2. Nome do objeto no bucket
+        # O hash só é conhecido ao fim do upload, então o prefixo do objeto passa a ser um UUID
         nome_seguro = secure_filename(file.filename)
-        object_name = f"{hash}-{nome_seguro}"
-
-        # Reposiciona o ponteiro do arquivo para o início antes do upload
-        file.seek(0) 
+        object_name = f"{uuid4().hex}-{nome_seguro}"
 
         content_type = file.content_type or 'application/pdf'
 
-        # --- CÓDIGO NOVO: Verifica e cria o bucket se ele não existir ---
-        try:
-            s3_client.head_bucket(Bucket=minio_bucket)
-        except:
-            # Se der erro (bucket não existe), a API cria ele na hora
-            s3_client.create_bucket(Bucket=minio_bucket)
-            # Define a política pública de leitura            
-            policy = {
-                "Version": "2012-10-17",
-                "Statement": [{
-                    "Sid": "PublicRead",
-                    "Effect": "Allow",
-                    "Principal": "*",
-                    "Action": ["s3:GetObject"],
-                    "Resource": [f"arn:aws:s3:::{minio_bucket}/*"]
-                }]
-            }
-
-            # Aplica a política ao bucket
-            s3_client.put_bucket_policy(Bucket=minio_bucket, Policy=json.dumps(policy))
-        # ----------------------------------------------------------------
+        ensure_bucket()
 
+        # 3. Upload para o MinIO/S3 calculando o Hash (Integridade) no mesmo passo
+        reader = HashingReader(file.stream)
         s3_client.upload_fileobj(
-            file,
+            reader,
             minio_bucket,
             object_name,
             ExtraArgs={
@@ -153,19 +275,8 @@ def create_policy():
             }
         )
 
-        url = f"{minio_url_public}/{minio_bucket}/{object_name}"
-
         # 4. Salvar Metadados no PostgreSQL
-        new_policy = Policies(
-            version=version,
-            description=description,
-            url=url,
-            hash=hash
-        )
-        db.session.add(new_policy)
-        db.session.commit()
-
-        return jsonify({"message": "Política criada com sucesso!", "policy": new_policy.to_json()}), 201
+        return save_policy(version, description, object_name, reader.h.hexdigest())
 
     except NoCredentialsError:
         return jsonify({"error": "Credenciais do S3 não configuradas"}), 500
@@ -174,6 +285,43 @@ def create_policy():
         print(f"ERRO NO UPLOAD: {str(e)}")
         return jsonify({"error": f"Erro interno: {str(e)}"}), 500
 
+def create_policy_from_s3_key():
+    """Registra uma política cujo arquivo o cliente já enviou ao MinIO via URL pré-assinada."""
+    data = request.get_json(silent=True) or {}
+    object_name = data.get('s3_key')
+    version = data.get('version')
+    description = data.get('description')
+
+    if not object_name or not version:
+        return jsonify({"error": "Campos 's3_key' e 'version' são obrigatórios"}), 400
+
+    try:
+        # O 's3_key' vem do cliente: se já pertence a uma política, não há o que registrar.
+        # Comparação exata da URL (um LIKE trataria '%' e '_' do 's3_key' como curingas)
+        existing = Policies.query.filter_by(url=policy_url(object_name)).first()
+        if existing:
+            return jsonify({"error": "Este 's3_key' já pertence a uma política cadastrada", "policy": existing.to_json()}), 409
+
+        try:
+            s3_client.head_object(Bucket=minio_bucket, Key=object_name)
+        except ClientError:
+            return jsonify({"error": "Arquivo não encontrado no storage para o 's3_key' informado"}), 400
+
+        # O hash é sempre calculado pelo servidor, lendo o objeto em blocos pela rede interna
+        h = hashlib.sha256()
+        body = s3_client.get_object(Bucket=minio_bucket, Key=object_name)['Body']
+        for chunk in iter(lambda: body.read(64 * 1024), b''):
+            h.update(chunk)
+
+        return save_policy(version, description, object_name, h.hexdigest())
+
+    except NoCredentialsError:
+        return jsonify({"error": "Credenciais do S3 não configuradas"}), 500
+    except Exception as e:
+        db.session.rollback()
+        print(f"ERRO NO REGISTRO: {str(e)}")
+        return jsonify({"error": f"Erro interno: {str(e)}"}), 500
+
 @app.route('/policies/latest', methods=['GET'])
 def get_latest_policy():
     """
@@ -194,7 +342,8 @@ def get_all_policies():
     Endpoint para listar todas as versões de políticas.
     """
     try:
-        policies = Policies.query.order_by(Policies.published_at.desc()).all()
+        # raiseload impede lazy loads acidentais caso a tabela ganhe relacionamentos
+        policies = Policies.query.options(raiseload('*')).order_by(Policies.published_at.desc()).all()
         return jsonify([p.to_json() for p in policies]), 200
     except Exception as e:
         return jsonify({"error": f"Erro interno: {str(e)}"}), 500
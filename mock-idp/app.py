@@ -1,6 +1,9 @@
 import os
+import orjson
+import hmac
+import base64
+import hashlib
 import datetime
-import jwt
 from flask import Flask, request, jsonify
 
 app = Flask(__name__)
@@ -8,6 +11,24 @@ app = Flask(__name__)
 # A chave secreta DEVE ser a mesma que a api-consentimentos usa para validar.
 # Na AWS, ambas lerão do ficheiro .env
 app.config['JWT_SECRET'] = os.environ.get('JWT_SECRET', 'chave-super-secreta-para-a-poc')
+# Convertida para bytes uma única vez, fora do caminho de cada login
+SECRET_BYTES = app.config['JWT_SECRET'].encode('utf-8')
+
+# --- Assinatura do JWT (HS256) ---
+# Cabeçalho fixo: serializado e codificado em base64url uma única vez, na carga do módulo
+HEADER_B64 = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=')
+# HMAC já inicializado com a chave; cada token só faz .copy() e processa header.payload
+_HMAC_PROTOTYPE = hmac.new(SECRET_BYTES, None, hashlib.sha256)
+
+def _b64url(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=')
+
+def sign_jwt(payload):
+    """Serialização compacta JWS (header.payload.assinatura), compatível com o PyJWT."""
+    signing_input = HEADER_B64 + b'.' + _b64url(orjson.dumps(payload))
+    h = _HMAC_PROTOTYPE.copy()
+    h.update(signing_input)
+    return (signing_input + b'.' + _b64url(h.digest())).decode('ascii')
 
 @app.route('/auth/mock-login', methods=['POST'])
 def mock_login():
@@ -18,15 +39,16 @@ def mock_login():
         return jsonify({'error': 'user_id é obrigatório para o login simulado'}), 400
         
     user_id = data['user_id']
+    iat = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
     
     payload = {
         'user_id': user_id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-        'iat': datetime.datetime.utcnow(),
+        'exp': iat + 3600, # 1 hora
+        'iat': iat,
         'iss': 'poc-mestrado-idp'
     }
     
-    token = jwt.encode(payload, app.config['JWT_SECRET'], algorithm='HS256')
+    token = sign_jwt(payload)
     
     return jsonify({
         'message': 'Login simulado com sucesso.',
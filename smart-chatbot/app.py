@@ -1,16 +1,291 @@
 import os
-import requests
-from flask import Flask, render_template, jsonify, request, session
+import orjson
+import time
+import secrets
+import asyncio
+import httpx
+import msgspec
+import redis.asyncio as redis
+from functools import wraps
+from typing import Optional
+from quart import Quart, Response, send_file, jsonify, request, session
+from quart.json.provider import JSONProvider
+from quart.sessions import SessionInterface, SecureCookieSession
 
-app = Flask(__name__)
+app = Quart(__name__)
 
-# OBRIGATÓRIO: A secret_key é necessária para assinar os cookies de sessão do Flask.
+class ORJSONProvider(JSONProvider):
+    """jsonify e request.get_json com orjson: serializa direto para bytes, sem passar pelo json da stdlib."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+app.json = ORJSONProvider(app)
+
+# OBRIGATÓRIO: A secret_key é necessária para assinar os cookies de sessão do Quart.
 # Em produção (AWS), isso DEVE vir do seu arquivo .env.
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'chave-super-segura-para-sessao-do-chatbot')
 
 URL_API_POLITICAS = os.environ.get('URL_API_POLITICAS', 'http://api-politicas:5000')
 URL_API_CONSENTIMENTOS = os.environ.get('URL_API_CONSENTIMENTOS', 'http://api-consentimentos:5000')
 URL_MOCK_IDP = os.environ.get('URL_MOCK_IDP', 'http://mock-idp:5000') # Nova dependência
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
+# As sessões guardam o JWT do usuário: ficam em um Redis próprio, com senha e sem despejo
+# de chaves (noeviction), separado do cache descartável acima
+SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', 'redis://redis-sessions:6379/0')
+
+# Cliente HTTP assíncrono compartilhado: enquanto uma chamada às APIs internas
+# aguarda resposta, o mesmo worker atende outras requisições
+client = None
+cache = None # Cliente Redis, compartilhado da mesma forma
+session_store = None # Cliente do Redis de sessões
+
+# Falhas ao abrir a conexão (origem reiniciando, DNS do Docker) são repetidas com
+# backoff exponencial; como a requisição não chegou à origem, vale também para POST/DELETE
+UPSTREAM_RETRIES = 2
+
+def upstream_transport(max_connections, max_keepalive_connections=None):
+    """
+    Transporte com pool próprio para um host interno. HTTP/2 multiplexa as chamadas
+    em uma única conexão TCP; se a origem não negociar h2 (ex.: http:// sem proxy na frente), usa HTTP/1.1.
+    """
+    return httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=UPSTREAM_RETRIES,
+        limits=httpx.Limits(
+            max_keepalive_connections=max_keepalive_connections or max_connections,
+            max_connections=max_connections
+        )
+    )
+
+@app.before_serving
+async def open_client():
+    global client, cache, session_store
+    cache = redis.Redis.from_url(REDIS_URL)
+    session_store = redis.Redis.from_url(SESSION_REDIS_URL)
+    client = httpx.AsyncClient(
+        # (connect, read): 1 s para abrir a conexão, 5 s para as demais operações
+        timeout=httpx.Timeout(5.0, connect=1.0),
+        transport=upstream_transport(200, max_keepalive_connections=100),
+        # Um pool por API interna: um host lento não esgota as conexões dos outros
+        mounts={
+            URL_API_POLITICAS: upstream_transport(100),
+            URL_API_CONSENTIMENTOS: upstream_transport(100),
+            URL_MOCK_IDP: upstream_transport(20) # login é raro e lento; não disputa conexões com as APIs
+        },
+    )
+
+@app.after_serving
+async def close_client():
+    await client.aclose()
+    await cache.aclose()
+    await session_store.aclose()
+
+# --- Sessão no Servidor (Redis) ---
+SESSION_KEY_PREFIX = 'session:'
+SESSION_TTL = 3600 # mesmo prazo do JWT emitido pelo IdP
+
+class RedisSession(SecureCookieSession):
+    """Sessão cujos dados ficam no Redis; sid é o id aleatório levado pelo cookie."""
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.previous_sid = None # id descartado por regenerate(), apagado na próxima gravação
+        self.persisted = False
+
+    def regenerate(self):
+        """Troca o id e descarta os dados: chamada no login, contra fixação de sessão."""
+        self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.clear()
+
+class RedisSessionInterface(SessionInterface):
+    """
+    Troca o cookie assinado (que carregava o JWT inteiro a cada requisição) por um id
+    opaco: o JWT e o user_id só existem no Redis.
+    """
+    async def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                data = await session_store.get(SESSION_KEY_PREFIX + sid)
+            except redis.RedisError:
+                data = None
+            if data:
+                return RedisSession(orjson.loads(data), sid)
+        # Sem dados no servidor, o id recebido é descartado
+        return RedisSession()
+
+    async def store(self, session):
+        """Grava a sessão no Redis e apaga o id anterior (se houver); propaga RedisError."""
+        async with session_store.pipeline(transaction=True) as pipe:
+            if session.previous_sid:
+                pipe.delete(SESSION_KEY_PREFIX + session.previous_sid)
+            pipe.set(SESSION_KEY_PREFIX + session.sid, orjson.dumps(dict(session)), ex=SESSION_TTL)
+            await pipe.execute()
+        session.previous_sid = None
+        session.persisted = True
+
+    async def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session.modified:
+            return
+        try:
+            if not session:
+                # session.clear() (ex.: após o direito ao esquecimento): apaga no servidor e no navegador
+                await session_store.delete(SESSION_KEY_PREFIX + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+                return
+            if not session.persisted:
+                await self.store(session)
+        except redis.RedisError as e:
+            print(f"Erro ao gravar a sessão no Redis: {str(e)}")
+            return
+        response.set_cookie(
+            name, session.sid,
+            max_age=SESSION_TTL,
+            domain=domain, path=path,
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+app.session_interface = RedisSessionInterface()
+
+# --- Cache da Política Vigente (Redis) ---
+# Chave própria: só guarda corpos que passaram pelo Policy abaixo. O admin-panel grava o corpo
+# bruto em 'policies:latest' e, no upload, invalida as duas
+LATEST_POLICY_KEY = 'policies:latest:validated'
+LATEST_POLICY_TTL = 30          # segundos em que a entrada é servida sem consultar a api-politicas
+STALE_KEEP_SECONDS = 24 * 3600  # por quanto tempo a última resposta fica guardada como fallback
+
+def cached(key, ttl):
+    """
+    Guarda a resposta (status, corpo) da função decorada em um hash do Redis e devolve
+    (status, corpo, estado_do_cache). Entrada fresca é servida direto; com a entrada velha,
+    só quem obtém o lock (SET NX PX) consulta a origem e os demais servem a cópia antiga.
+    Se a origem estiver fora do ar, serve a última cópia conhecida ('stale').
+    """
+    def decorator(fetch):
+        @wraps(fetch)
+        async def wrapper():
+            now = time.time()
+            try:
+                entry = await cache.hgetall(key)
+            except redis.RedisError:
+                entry = None
+
+            if entry:
+                stale = (int(entry[b'status']), entry[b'body'], 'stale')
+                if float(entry[b'stale_at']) > now:
+                    return int(entry[b'status']), entry[b'body'], 'hit'
+                try:
+                    if not await cache.set(f"{key}:lock", 1, nx=True, px=ttl * 1000):
+                        return stale # Outro worker já está atualizando a entrada
+                except redis.RedisError:
+                    pass
+
+            try:
+                status, body = await fetch()
+            except httpx.RequestError:
+                if entry:
+                    return stale
+                raise
+            if status >= 500:
+                return stale if entry else (status, body, 'miss')
+
+            try:
+                async with cache.pipeline(transaction=True) as pipe:
+                    pipe.hset(key, mapping={'status': status, 'body': body, 'stale_at': now + ttl})
+                    pipe.expire(key, STALE_KEEP_SECONDS)
+                    await pipe.execute()
+            except redis.RedisError:
+                pass
+            return status, body, 'miss'
+        return wrapper
+    return decorator
+
+class Policy(msgspec.Struct):
+    """Formato de /policies/latest (Policies.to_json na api-politicas)."""
+    id: int
+    version: str
+    published_at: str
+    description: Optional[str]
+    url: str
+    hash: str
+
+_policy_decoder = msgspec.json.Decoder(Policy)
+
+@cached(LATEST_POLICY_KEY, LATEST_POLICY_TTL)
+async def fetch_latest_policy():
+    response = await client.get(f"{URL_API_POLITICAS}/policies/latest")
+    if response.status_code != 200:
+        return response.status_code, response.content
+    # Decodifica e valida o formato em uma única passada: resposta fora do contrato
+    # vira 502 (e não entra no cache) em vez de chegar ao navegador
+    try:
+        policy = _policy_decoder.decode(response.content)
+    except msgspec.DecodeError:
+        return 502, orjson.dumps({"error": "Resposta inválida da API de Políticas"})
+    return 200, msgspec.json.encode(policy)
+
+def passthrough(resp):
+    """Repassa a resposta da API interna como veio (bytes, status e Content-Type), sem decodificar o JSON."""
+    return Response(resp.content, status=resp.status_code,
+                    headers={'Content-Type': resp.headers.get('Content-Type', 'application/json')})
+
+async def stream_passthrough(method, url, headers, content=None):
+    """
+    Como passthrough, mas sem descompactar: a chamada interna leva o Accept-Encoding do
+    navegador e os bytes chegam a ele exatamente como a API os enviou (com o mesmo
+    Content-Encoding), de modo que a descompressão fica a cargo do cliente.
+    Devolve (resposta httpx, resposta Quart); o corpo é lido à medida que é enviado.
+    """
+    headers = {**headers, 'Accept-Encoding': request.headers.get('Accept-Encoding', 'identity')}
+    resp = await client.send(client.build_request(method, url, content=content, headers=headers), stream=True)
+
+    async def body():
+        try:
+            async for chunk in resp.aiter_raw():
+                yield chunk
+        finally:
+            await resp.aclose()
+
+    out_headers = {
+        'Content-Type': resp.headers.get('Content-Type', 'application/json'),
+        # A codificação do corpo depende do Accept-Encoding do navegador: caches intermediários
+        # não podem servir uma resposta gzip a quem não a pediu
+        'Vary': 'Accept-Encoding'
+    }
+    for name in ('Content-Encoding', 'Content-Length'):
+        if name in resp.headers:
+            out_headers[name] = resp.headers[name]
+    return resp, Response(body(), status=resp.status_code, headers=out_headers)
+
+# --- Validação de Entrada (msgspec) ---
+# Decodifica e valida o JSON do navegador em uma única passada; tipo errado vira 400, não 500
+class LoginReq(msgspec.Struct):
+    user_id: int
+
+class ConsentReq(msgspec.Struct):
+    id_user: int
+    id_policy: int
+    channel: str
+    status: str
+
+_login_decoder = msgspec.json.Decoder(LoginReq)
+_consent_decoder = msgspec.json.Decoder(ConsentReq)
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+CHAT_HTML_PATH = os.path.join(app.static_folder, 'chat.html')
 
 # --- FUNÇÃO AUXILIAR DE SEGURANÇA ---
 def get_auth_headers():
@@ -21,98 +296,139 @@ def get_auth_headers():
     return {'Authorization': f'Bearer {token}'}
 
 @app.route('/')
-def index():
-    return render_template('chat.html')
+async def index():
+    # A página não tem variáveis de template: é servida como arquivo estático, sem passar
+    # pelo Jinja; conditional=True responde 304 quando o navegador já tem a versão atual
+    return await send_file(CHAT_HTML_PATH, conditional=True)
 
 # --- 1. NOVA ROTA: LOGIN E GESTÃO DE IDENTIDADE ---
 @app.route('/api/auth/login', methods=['POST'])
-def login():
+async def login():
     """Solicita o token JWT ao Provedor de Identidade e guarda na sessão."""
-    data = request.json
-    user_id = data.get('user_id')
-    
-    if not user_id:
-        return jsonify({"error": "ID de usuário ausente"}), 400
+    try:
+        req = _login_decoder.decode(await request.get_data())
+    except msgspec.DecodeError:
+        return jsonify({"error": "ID de usuário ausente ou inválido"}), 400
 
     try:
-        resp = requests.post(f"{URL_MOCK_IDP}/auth/mock-login", json={"user_id": int(user_id)})
-        
+        resp = await client.post(f"{URL_MOCK_IDP}/auth/mock-login", content=msgspec.json.encode(req), headers=JSON_HEADERS)
+
         if resp.status_code == 200:
+            # Novo id de sessão a cada login: um id obtido antes (ex.: plantado por terceiros
+            # no navegador da vítima) não herda a identidade autenticada agora
+            session.regenerate()
             # Armazena as credenciais de forma segura na sessão do usuário
-            session['jwt_token'] = resp.json().get('token')
-            session['user_id'] = int(user_id)
+            session['jwt_token'] = orjson.loads(resp.content).get('token')
+            session['user_id'] = req.user_id
+            # Grava já aqui: se o Redis de sessões falhar, o login não pode responder 200 sem sessão
+            try:
+                await app.session_interface.store(session)
+            except redis.RedisError as e:
+                return jsonify({"error": f"Falha ao gravar a sessão: {str(e)}"}), 503
             return jsonify({"message": "Identidade confirmada com sucesso"}), 200
-            
+
         return jsonify({"error": "Falha na autenticação do provedor de identidade"}), resp.status_code
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         return jsonify({"error": f"Falha de comunicação com o IdP: {str(e)}"}), 500
 
 # --- 2. ROTAS PÚBLICAS ---
 @app.route('/api/policy', methods=['GET'])
-def get_policy():
+async def get_policy():
     """A leitura da política vigente pode permanecer pública."""
     try:
-        resp = requests.get(f"{URL_API_POLITICAS}/policies/latest")
-        return jsonify(resp.json()), resp.status_code
-    except requests.exceptions.RequestException as e:
+        status, body, cache_state = await fetch_latest_policy()
+        return Response(body, status=status, mimetype='application/json', headers={'X-Cache': cache_state})
+    except httpx.RequestError as e:
         return jsonify({"error": f"Falha de comunicação com a API de Políticas: {str(e)}"}), 500
 
 # --- 3. ROTAS PROTEGIDAS (EXIGEM TOKEN JWT) ---
-@app.route('/api/consent', methods=['POST'])
-def record_consent():
-    """Registra o consentimento anexando a prova de identidade (JWT)."""
-    headers = get_auth_headers()
-    if not headers:
-        return jsonify({"error": "Não autorizado. O usuário deve se identificar primeiro."}), 401
+def end_session_on_success(resp):
+    """Se o esquecimento for bem-sucedido, a identidade foi apagada. Devemos limpar a sessão local."""
+    if resp.status_code == 200:
+        session.clear()
 
-    data = request.json
-    
-    # Validação de segurança dupla: o ID enviado na requisição deve casar com o ID da sessão
-    if int(data.get('id_user')) != session.get('user_id'):
-        return jsonify({"error": "Conflito de identidade detectado."}), 403
+def make_handler(method, build_url, decoder, owner, forbidden, unavailable, after=None):
+    """
+    Gera o handler de uma rota protegida: exige o JWT da sessão, valida o corpo (se houver),
+    confere que o dono dos dados (campo `owner` da rota ou do corpo) é o usuário logado e
+    repassa a chamada à API interna.
+    """
+    async def handler(**view_args):
+        headers = get_auth_headers()
+        if not headers:
+            return jsonify({"error": "Não autorizado. O usuário deve se identificar primeiro."}), 401
 
-    try:
-        resp = requests.post(f"{URL_API_CONSENTIMENTOS}/consents", json=data, headers=headers)
-        return jsonify(resp.json()), resp.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Falha de comunicação com a API de Consentimentos: {str(e)}"}), 500
-
-@app.route('/api/consent/history/<int:user_id>', methods=['GET'])
-def get_history(user_id):
-    """Consulta o histórico usando autenticação."""
-    headers = get_auth_headers()
-    if not headers:
-        return jsonify({"error": "Não autorizado."}), 401
+        content = None
+        owner_id = view_args.get(owner)
+        if decoder:
+            try:
+                req = decoder.decode(await request.get_data())
+            except msgspec.DecodeError as e:
+                return jsonify({"error": f"Dados inválidos: {str(e)}"}), 400
+            owner_id = getattr(req, owner)
+            content = msgspec.json.encode(req)
+            headers = {**headers, **JSON_HEADERS}
 
-    if user_id != session.get('user_id'):
-        return jsonify({"error": "Acesso negado aos dados de terceiros."}), 403
+        # Validação de segurança dupla: o ID da requisição deve casar com o ID da sessão
+        if owner_id != session.get('user_id'):
+            return jsonify({"error": forbidden}), 403
 
-    try:
-        resp = requests.get(f"{URL_API_CONSENTIMENTOS}/consents/user/{user_id}", headers=headers)
-        return jsonify(resp.json()), resp.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Falha ao buscar histórico: {str(e)}"}), 500
-
-@app.route('/api/consent/forget/<int:user_id>', methods=['DELETE'])
-def forget_user(user_id):
-    """Aciona o Crypto-Shredding e destrói a sessão."""
+        try:
+            resp, response = await stream_passthrough(method, build_url(**view_args), headers, content)
+        except httpx.RequestError as e:
+            return jsonify({"error": f"{unavailable}: {str(e)}"}), 500
+
+        if after:
+            after(resp)
+        return response
+    return handler
+
+# (endpoint, rota, método, URL interna, decoder do corpo, dono dos dados, msg 403, msg de falha, pós-processamento)
+PROTECTED_ROUTES = [
+    ('record_consent', '/api/consent', 'POST',
+     lambda: f"{URL_API_CONSENTIMENTOS}/consents",
+     _consent_decoder, 'id_user',
+     "Conflito de identidade detectado.", "Falha de comunicação com a API de Consentimentos", None),
+    ('get_history', '/api/consent/history/<int:user_id>', 'GET',
+     lambda user_id: f"{URL_API_CONSENTIMENTOS}/consents/user/{user_id}",
+     None, 'user_id',
+     "Acesso negado aos dados de terceiros.", "Falha ao buscar histórico", None),
+    ('forget_user', '/api/consent/forget/<int:user_id>', 'DELETE',
+     lambda user_id: f"{URL_API_CONSENTIMENTOS}/users/{user_id}/forget",
+     None, 'user_id',
+     "Acesso negado para excluir dados de terceiros.", "Falha ao processar o direito ao esquecimento", end_session_on_success),
+]
+
+for endpoint, path, method, build_url, decoder, owner, forbidden, unavailable, after in PROTECTED_ROUTES:
+    app.add_url_rule(path, endpoint, make_handler(method, build_url, decoder, owner, forbidden, unavailable, after), methods=[method])
+
+@app.route('/api/dashboard', methods=['GET'])
+async def get_dashboard():
+    """
+    Agrega a política vigente e o histórico do usuário logado em uma única resposta.
+    As duas chamadas são feitas em paralelo: o tempo total é o da mais lenta, não a soma.
+    """
     headers = get_auth_headers()
     if not headers:
         return jsonify({"error": "Não autorizado."}), 401
 
-    if user_id != session.get('user_id'):
-        return jsonify({"error": "Acesso negado para excluir dados de terceiros."}), 403
-
+    user_id = session.get('user_id')
     try:
-        resp = requests.delete(f"{URL_API_CONSENTIMENTOS}/users/{user_id}/forget", headers=headers)
-        
-        # Se o esquecimento for bem-sucedido, a identidade foi apagada. Devemos limpar a sessão local.
-        if resp.status_code == 200:
-            session.clear()
-            
-        return jsonify(resp.json()), resp.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Falha ao processar o direito ao esquecimento: {str(e)}"}), 500
+        (policy_status, policy_body, _), history_resp = await asyncio.gather(
+            fetch_latest_policy(),
+            client.get(f"{URL_API_CONSENTIMENTOS}/consents/user/{user_id}", headers=headers)
+        )
+    except httpx.RequestError as e:
+        return jsonify({"error": f"Falha ao montar o painel: {str(e)}"}), 500
+
+    # 404 no histórico apenas significa que ainda não há consentimentos
+    if history_resp.status_code not in (200, 404):
+        return passthrough(history_resp)
+
+    # Os dois corpos já são JSON válido: são concatenados como bytes, sem decodificar
+    policy = policy_body if policy_status == 200 else b'null'
+    history = history_resp.content if history_resp.status_code == 200 else b'[]'
+    return Response(b'{"policy":' + policy + b',"history":' + history + b'}', status=200, mimetype='application/json')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000)